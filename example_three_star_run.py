@@ -1,9 +1,14 @@
 # example_three_star_run.py
-from io_fast import ShellSession, PngStream
+from io_fast import ShellSession, ShellFrameSource
+from pogo_adb import wm_size
 from pogo_config import default_pack
 from pogo_states import tag_three_star_pass
 
 if __name__ == "__main__":
     cfg = default_pack("./pogo_assets/Images")  # replace with your assets folder
-    with ShellSession() as sh, PngStream() as ps:
+    # Frames are captured on demand through the same shell, so the device only
+    # encodes the ones we read. PngStream() / RawFrameStream() stream continuously
+    # instead (and can prefetch behind taps) if capture latency matters more.
+    with ShellSession() as sh, ShellFrameSource(sh) as ps:
+        sh.discover_touch(*wm_size(sh=sh))  # sendevent taps; falls back to 'input tap'
         tag_three_star_pass(cfg, sh, ps)
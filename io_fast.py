@@ -1,41 +1,315 @@
 # io_fast.py
-import io
+import mmap
+import os
+import queue
+import re
+import struct
 import subprocess
-from typing import Optional
+import threading
+import time
+import zlib
+import ctypes.util
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Sequence, Tuple, Union
 
 import numpy as np
 import cv2
 
+try:
+    import xxhash
+except ImportError:  # optional; frame dedup falls back to crc32
+    xxhash = None
+
+# Optional libspng binding (cffi, ABI mode): decodes straight into our own
+# numpy buffers. Without cffi or libspng, PNGs go through cv2.imdecode.
+try:
+    import cffi
+    _ffi = cffi.FFI()
+    _ffi.cdef("""
+        typedef struct spng_ctx spng_ctx;
+        struct spng_ihdr {
+            uint32_t width; uint32_t height;
+            uint8_t bit_depth; uint8_t color_type; uint8_t compression_method;
+            uint8_t filter_method; uint8_t interlace_method;
+        };
+        spng_ctx *spng_ctx_new(int flags);
+        void spng_ctx_free(spng_ctx *ctx);
+        int spng_set_png_buffer(spng_ctx *ctx, const void *buf, size_t size);
+        int spng_get_ihdr(spng_ctx *ctx, struct spng_ihdr *ihdr);
+        int spng_decoded_image_size(spng_ctx *ctx, int fmt, size_t *len);
+        int spng_decode_image(spng_ctx *ctx, void *out, size_t len, int fmt, int flags);
+        const char *spng_strerror(int err);
+    """)
+    _spng = _ffi.dlopen(ctypes.util.find_library("spng") or "libspng.so")
+except (ImportError, OSError):
+    _ffi = _spng = None
+
+SPNG_FMT_RGBA8 = 1
+SPNG_FMT_RGB8 = 4
+SPNG_FMT_G8 = 64
+_PNG_GRAY = 0  # IHDR color type
+
+
+_U32 = struct.Struct(">I")
+_IHDR = struct.Struct(">II")  # width, height at offset 16 of a PNG
+# Runs _StreamSource.prefetch_next reads; one pipe read in flight is enough
+_PREFETCH_POOL = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frame-prefetch")
+
+# Hot commands pre-encoded; bytes %-formatting skips a str build + encode per call
+_TAP_FMT = b"input tap %d %d"
+_SWIPE_FMT = b"input swipe %d %d %d %d %d"
+_DONE_FMT = b"; echo ---DONE-%d---\n"
+
+# linux/input-event-codes.h
+_EV_SYN, _EV_KEY, _EV_ABS = 0, 1, 3
+_SYN_REPORT = 0
+_BTN_TOUCH = 330
+_ABS_MT_SLOT, _ABS_MT_POSITION_X, _ABS_MT_POSITION_Y, _ABS_MT_TRACKING_ID = 47, 53, 54, 57
+_ABS_MAX_RE = re.compile(r"(ABS_MT_POSITION_[XY])\s*:.*?\bmax (\d+)")
+
+
+class TouchDevice(NamedTuple):
+    """Touchscreen found by ShellSession.discover_touch(); scale maps screen px -> device units."""
+    node: str
+    scale_x: float
+    scale_y: float
+    btn_touch: bool
+
+
+def _parse_touch(getevent_pl: str, width: int, height: int) -> Optional[TouchDevice]:
+    for dev in getevent_pl.split("add device")[1:]:
+        m = re.search(r"(/dev/input/event\d+)", dev)
+        maxes = dict(_ABS_MAX_RE.findall(dev))
+        if m and len(maxes) == 2:
+            return TouchDevice(m.group(1),
+                               (int(maxes["ABS_MT_POSITION_X"]) + 1) / width,
+                               (int(maxes["ABS_MT_POSITION_Y"]) + 1) / height,
+                               "BTN_TOUCH" in dev)
+    return None
+
 
 class ShellSession:
     """
     One persistent 'adb shell' you can feed multiple commands to.
     Use .tap/.swipe/.key/.sleep helpers to avoid string building at call sites.
+    run_capture() runs a command and returns its stdout, and capture_frame()
+    returns one screencap; both bracket the output with numbered echo'd
+    sentinels so replies can't be confused with earlier output.
+    stdout is binary, which relies on adb not allocating a pty (it doesn't
+    when stdin is a pipe).
+    After discover_touch() succeeds, taps and swipes are injected with
+    sendevent straight into the touchscreen node instead of through the
+    Java 'input' tool, which costs a JVM start per call.
+    tap/tap_batch/swipe are submitted without waiting and return an id; the
+    shell runs commands in order, so wait_for(id) / await_all() only have to
+    read up to that id's completion marker.
     """
     def __init__(self, adb: str = "adb", serial: Optional[str] = None):
+        self.serial = serial
         self.args = [adb] + (["-s", serial] if serial else []) + ["shell"]
-        # text=True so we can .write(str); we never read stdout to avoid blocking
+        # Binary pipes so frames survive; unbuffered so stdin writes go straight
+        # out without a flush. stdout is drained by a reader thread so
+        # fire-and-forget commands never block on a full pipe
         self.p = subprocess.Popen(self.args,
                                   stdin=subprocess.PIPE,
-                                  stdout=subprocess.DEVNULL,
+                                  stdout=subprocess.PIPE,
                                   stderr=subprocess.DEVNULL,
-                                  text=True,
-                                  bufsize=1)
+                                  bufsize=0)
+        self._chunks: "queue.Queue[Optional[bytes]]" = queue.Queue()
+        self._pending = bytearray()
+        self._token = 0      # numbers both sentinels and submitted commands
+        self._submitted = 0  # id of the last _submit()
+        self._completed = 0  # every command with id <= this has finished
+        self._tracking_id = 0
+        self.touch: Optional[TouchDevice] = None
+        self._cmd_cost = 0.0  # seconds per on-device command (sendevent), see discover_touch
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def _read_loop(self):
+        read = self.p.stdout.read  # raw (bufsize=0): returns whatever is available
+        while True:
+            chunk = read(1 << 16)
+            if not chunk:
+                break
+            self._chunks.put(chunk)
+        self._chunks.put(None)  # shell exited
+
+    def _read_until(self, marker: bytes, deadline: float) -> bytes:
+        """Consume stdout up to and including marker; return what came before it."""
+        pending = self._pending
+        start = 0
+        while True:
+            i = pending.find(marker, start)
+            if i >= 0:
+                out = bytes(pending[:i])
+                del pending[:i + len(marker)]
+                return out
+            start = max(0, len(pending) - len(marker) + 1)
+            try:
+                chunk = self._chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                raise TimeoutError("adb shell did not answer in time") from None
+            if chunk is None:
+                raise RuntimeError("adb shell exited")
+            pending += chunk
+
+    def _bracketed(self, cmd: str, timeout: float) -> bytes:
+        with self._lock:
+            self._token += 1
+            begin = f"---BEGIN-{self._token}---"
+            end = f"---END-{self._token}---"
+            self.send(f"echo {begin}; {cmd}; echo {end}")
+            deadline = time.monotonic() + timeout
+            self._read_until(begin.encode() + b"\n", deadline)  # drops output of earlier commands
+            self._completed = self._token - 1
+            return self._read_until(end.encode() + b"\n", deadline)
+
+    def _submit(self, cmd: bytes) -> int:
+        """Write cmd followed by its completion marker; returns the command id."""
+        if not cmd:
+            # "; echo" alone is a syntax error that kills the shell; nothing to wait for
+            # beyond what is already in flight
+            return self._submitted
+        with self._lock:
+            self._token += 1
+            self._write(cmd + _DONE_FMT % self._token)
+            self._submitted = self._token
+            return self._token
+
+    def wait_for(self, cmd_id: int, timeout: float = 10.0) -> None:
+        """Block until the submitted command cmd_id (and so everything before it) has run."""
+        with self._lock:
+            if cmd_id <= self._completed:
+                return
+            self._read_until(b"---DONE-%d---\n" % cmd_id, time.monotonic() + timeout)
+            self._completed = cmd_id
+
+    def await_all(self, timeout: float = 10.0) -> None:
+        """Block until every command submitted so far has run."""
+        self.wait_for(self._submitted, timeout)
+
+    def run_capture(self, cmd: str, timeout: float = 10.0) -> str:
+        """Run cmd in the session and return its stdout (without the trailing newline)."""
+        return self._bracketed(cmd, timeout).decode("utf-8", "replace").rstrip("\r\n")
+
+    def capture_frame(self, raw: bool = False, timeout: float = 10.0) -> bytes:
+        """One screencap on demand: PNG bytes, or the raw header + RGBA payload if raw."""
+        return self._bracketed("screencap" if raw else "screencap -p", timeout)
+
+    def tap_then_capture(self, x: int, y: int, settle: float = 0.2, timeout: float = 10.0) -> bytes:
+        """Tap, let the UI settle for settle seconds on-device, then screencap -p: one round trip, PNG bytes back."""
+        return self._bracketed(f"{self._tap_cmd(x, y)}; sleep {settle}; screencap -p", timeout)
+
+    def _write(self, data: bytes) -> None:
+        # Raw pipe: a write may be partial
+        mv = memoryview(data)
+        while mv:
+            mv = mv[self.p.stdin.write(mv):]
 
     def send(self, cmd: str) -> None:
-        self.p.stdin.write(cmd + "\n")
-        self.p.stdin.flush()
+        self._write(cmd.encode("ascii") + b"\n")
+
+    def discover_touch(self, width: int, height: int) -> bool:
+        """Find the touchscreen via 'getevent -pl'; width/height are the screen size in px."""
+        self.touch = _parse_touch(self.run_capture("getevent -pl"), width, height)
+        if self.touch is not None:
+            self._cmd_cost = self._measure_cmd_cost()
+        return self.touch is not None
+
+    def _measure_cmd_cost(self, n: int = 8) -> float:
+        # Every sendevent (and sleep) is a fresh process on the device; time n empty
+        # SYN_REPORTs against an empty command to get the per-process cost, which
+        # paces swipe() steps.
+        t0 = time.monotonic()
+        self.run_capture("true")
+        t1 = time.monotonic()
+        self.run_capture("; ".join([f"sendevent {self.touch.node} {_EV_SYN} {_SYN_REPORT} 0"] * n))
+        t2 = time.monotonic()
+        return max(0.0, ((t2 - t1) - (t1 - t0)) / n)
+
+    def _ev(self, out: List[str], typ: int, code: int, value: int):
+        out.append(f"sendevent {self.touch.node} {typ} {code} {value}")
+
+    def _touch_down(self, out: List[str], x: int, y: int):
+        t = self.touch
+        self._tracking_id = (self._tracking_id + 1) & 0xFFFF
+        self._ev(out, _EV_ABS, _ABS_MT_SLOT, 0)
+        self._ev(out, _EV_ABS, _ABS_MT_TRACKING_ID, self._tracking_id)
+        self._touch_move(out, x, y, sync=False)
+        if t.btn_touch:
+            self._ev(out, _EV_KEY, _BTN_TOUCH, 1)
+        self._ev(out, _EV_SYN, _SYN_REPORT, 0)
+
+    def _touch_move(self, out: List[str], x: int, y: int, sync: bool = True):
+        t = self.touch
+        self._ev(out, _EV_ABS, _ABS_MT_POSITION_X, int(x * t.scale_x))
+        self._ev(out, _EV_ABS, _ABS_MT_POSITION_Y, int(y * t.scale_y))
+        if sync:
+            self._ev(out, _EV_SYN, _SYN_REPORT, 0)
+
+    def _touch_up(self, out: List[str]):
+        self._ev(out, _EV_ABS, _ABS_MT_TRACKING_ID, -1)  # lift; sendevent atoi()s its values
+        if self.touch.btn_touch:
+            self._ev(out, _EV_KEY, _BTN_TOUCH, 0)
+        self._ev(out, _EV_SYN, _SYN_REPORT, 0)
+
+    def _tap_cmd(self, x: int, y: int) -> str:
+        if self.touch is None:
+            return f"input tap {x} {y}"
+        out: List[str] = []
+        self._touch_down(out, x, y)
+        self._touch_up(out)
+        return "; ".join(out)
+
+    def tap_batch(self, points: Sequence[Tuple[int, ...]], delay: float = 0.0) -> int:
+        """
+        Several taps in one write. Points are (x, y) or (x, y, delay_ms); a
+        delay_ms is slept on-device after that tap, otherwise delay seconds
+        are slept between taps. The returned id completes after the last sleep.
+        """
+        if not points:
+            return self._submitted
+        parts: List[str] = []
+        for i, p in enumerate(points):
+            parts.append(self._tap_cmd(p[0], p[1]))
+            d = p[2] / 1000 if len(p) > 2 else (delay if i < len(points) - 1 else 0)
+            if d:
+                parts.append(f"sleep {d}")
+        return self._submit("; ".join(parts).encode("ascii"))
 
     # Convenience
-    def tap(self, x: int, y: int): self.send(f"input tap {x} {y}")
-    def swipe(self, x1: int, y1: int, x2: int, y2: int, dur_ms: int = 250):
-        self.send(f"input swipe {x1} {y1} {x2} {y2} {dur_ms}")
+    def tap(self, x: int, y: int) -> int:
+        if self.touch is None:
+            return self._submit(_TAP_FMT % (x, y))
+        return self._submit(self._tap_cmd(x, y).encode("ascii"))
+    def swipe(self, x1: int, y1: int, x2: int, y2: int, dur_ms: int = 250) -> int:
+        if self.touch is None:
+            return self._submit(_SWIPE_FMT % (x1, y1, x2, y2, dur_ms))
+        # Each move is 3 sendevent processes, measured by discover_touch, so steps
+        # are spaced by that cost: 60 Hz like input swipe when the device keeps up,
+        # fewer, coarser steps (still taking ~dur_ms overall) when it doesn't. The
+        # sleep filling out a step is itself a process, hence the extra cost.
+        move = 3 * self._cmd_cost
+        interval = max(0.016, move)
+        steps = max(2, int(dur_ms / 1000 / interval))
+        pause = interval - move - self._cmd_cost
+        out: List[str] = []
+        self._touch_down(out, x1, y1)
+        for i in range(1, steps + 1):
+            if pause > 0.002:
+                out.append(f"sleep {pause:.3f}")
+            self._touch_move(out, x1 + (x2 - x1) * i // steps, y1 + (y2 - y1) * i // steps)
+        self._touch_up(out)
+        return self._submit("; ".join(out).encode("ascii"))
     def key(self, keycode: str): self.send(f"input keyevent {keycode}")  # e.g. KEYCODE_BACK
     def sleep(self, seconds: float): self.send(f"sleep {seconds}")
 
     def close(self):
         try:
-            self.p.stdin.write("exit\n"); self.p.stdin.flush()
+            self._write(b"exit\n")
         except Exception:
             pass
         self.p.terminate()
@@ -44,55 +318,483 @@ class ShellSession:
     def __exit__(self, exc_type, exc, tb): self.close()
 
 
-class PngStream:
+class _FrameSource:
+    """
+    next_changed() for the frame sources: block until a frame differs from the
+    one whose digest the caller last saw, instead of sleep-and-repoll. PNG
+    sources compare digests of the encoded bytes (the whole PNG: a change low on
+    the screen only alters the tail of the deflate stream) and decode only
+    frames that changed; others hash the decoded buffer.
+    Also exposes .width/.height of the latest frame; they are taken from the
+    PNG IHDR or the raw header as frames are read, and only pull a frame if
+    none has been seen yet.
+    prefetch_next() is a no-op here; continuous streams (_StreamSource) override
+    it, while on-demand sources must not capture before the caller's settle wait.
+    """
+    _size: Optional[Tuple[int, int]] = None  # (width, height) of the latest frame
+
+    def prefetch_next(self) -> bool:
+        """Start reading the next frame in the background; False if this source doesn't prefetch."""
+        return False
+
+    def drop_prefetch(self) -> None:
+        """Forget a pending prefetch (e.g. an input went out since it started)."""
+
+    # digest of the PNG last decoded by next_frame, and that (reused) BGR buffer
+    _last_png_hash: Optional[int] = None
+    _last_frame: Optional[np.ndarray] = None
+
+    def _decode_cached(self, png, h: Optional[int] = None) -> np.ndarray:
+        # An idle screen streams identical PNGs: hash the bytes before decoding and
+        # hand back the previous mat when they match. Every colour decode of this
+        # source's decoder must come through here; gray decodes go to separate
+        # decoder buffers, so they leave _last_frame intact.
+        if h is None:
+            h = digest64(png)
+        if h != self._last_png_hash or self._last_frame is None:
+            self._last_frame = self.decoder.decode(png)
+            self._last_png_hash = h
+        return self._last_frame
+
+    def _frame_size(self) -> Tuple[int, int]:
+        while self._size is None:
+            self.next_frame()
+        return self._size
+
+    @property
+    def width(self) -> int:
+        return self._frame_size()[0]
+
+    @property
+    def height(self) -> int:
+        return self._frame_size()[1]
+
+    def _next_if_changed(self, prev_hash: Optional[int], gray: bool = False) \
+            -> Tuple[Optional[np.ndarray], Optional[int]]:
+        frame = self.next_frame()
+        if frame is None:
+            return None, prev_hash
+        h = digest64(frame)
+        if h == prev_hash:
+            return None, h
+        return (cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if gray else frame), h
+
+    def _png_if_changed(self, prev_hash: Optional[int], gray: bool = False) \
+            -> Tuple[Optional[np.ndarray], Optional[int]]:
+        png = self.next_png()
+        if png is None:
+            return None, prev_hash
+        h = digest64(png)
+        if h == prev_hash:
+            return None, h
+        # Colour decodes go through _decode_cached so its hash keeps describing
+        # what is in the decoder's (shared) BGR buffer
+        return (self.decoder.decode(png, True) if gray else self._decode_cached(png, h)), h
+
+    def next_changed(self, prev_hash: Optional[int], timeout: float, gray: bool = False) \
+            -> Tuple[Optional[np.ndarray], Optional[int]]:
+        """
+        (frame, digest) of the first frame whose digest != prev_hash, or
+        (None, prev_hash) on timeout. gray=True returns the luma plane only,
+        decoded as such where the decoder can.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            frame, h = self._next_if_changed(prev_hash, gray)
+            if frame is not None:
+                return frame, h
+            prev_hash = h
+            if time.monotonic() >= deadline:
+                return None, prev_hash
+
+
+class _StreamSource(_FrameSource, ABC):
+    """
+    A source fed by a continuous screencap loop, whose reads can be prefetched:
+    prefetch_next() starts reading the next frame's bytes (_fetch) on a
+    background thread, e.g. right after a tap while the caller sleeps, and the
+    next read joins it instead of going to the pipe. Decoding stays with the
+    reader, so buffers handed out earlier are not touched by a prefetch.
+    drop_prefetch() marks a pending prefetch stale: it is still joined (one
+    reader at a time) but its frame is discarded and a fresh one read.
+    """
+    _prefetch: Optional[Future] = None
+    _stale: Optional[Future] = None
+
+    @abstractmethod
+    def _fetch(self):
+        """Read the bytes of the next frame from the pipe."""
+
+    def prefetch_next(self) -> bool:
+        if self._prefetch is None:
+            self._prefetch = _PREFETCH_POOL.submit(self._fetch)
+        return True
+
+    def drop_prefetch(self) -> None:
+        fut, self._prefetch = self._prefetch, None
+        if fut is not None and not fut.cancel():
+            self._stale = fut
+
+    def _fetched(self):
+        stale, self._stale = self._stale, None
+        if stale is not None:
+            stale.result()  # join; its frame predates the last input
+        fut, self._prefetch = self._prefetch, None
+        return self._fetch() if fut is None else fut.result()
+
+
+class PngStream(_StreamSource):
     """
     Continuous screencap reader:
     adb exec-out sh -c 'while :; do screencap -p; done'
-    Call next_png() to get one PNG frame (bytes). Use decode_png() to get a cv2 mat.
+    Call next_png() to get one PNG frame, or next_frame() for a decoded cv2 mat
+    (decoded by a per-stream new_png_decoder(), which reuses the array when
+    libspng is installed).
+    The pipe is read with os.readv straight into a ring of mmap slots and
+    next_png() returns a memoryview of the slot holding the frame, so no bytes
+    object is built per frame. A view stays valid for the next
+    RING_SLOTS - 1 calls; copy it (bytes(png)) to keep it longer.
     """
+    RING_SLOTS = 3
+    SLOT_SIZE = 8 * 1024 * 1024  # grown if a frame doesn't fit
+
     def __init__(self, adb: str = "adb", serial: Optional[str] = None):
         args = [adb] + (["-s", serial] if serial else []) + \
                ["exec-out", "sh", "-c", "while :; do screencap -p; done"]
-        self.p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        # Unbuffered: reads go from the pipe into the ring, not via a BufferedReader
+        self.p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        self._fd = self.p.stdout.fileno()
+        self.decoder = new_png_decoder()
+        self._new_ring(self.SLOT_SIZE)
 
-    def next_png(self) -> Optional[bytes]:
-        out = self.p.stdout
-        if out is None:
-            return None
-        read = out.read
+    def _new_ring(self, slot_size: int, keep: bytes = b""):
+        # Views handed out by next_png keep the old mmap alive until dropped
+        self._slot_size = slot_size
+        self._ring = mmap.mmap(-1, self.RING_SLOTS * slot_size)
+        self._ring_mv = memoryview(self._ring)
+        self._slot = 0
+        self._mv = self._ring_mv[:slot_size]
+        self._mv[:len(keep)] = keep
+        self._have = len(keep)  # bytes read into the current slot
+
+    def _fill(self, end: int) -> bool:
+        """Read until the current slot holds at least end bytes; False on EOF."""
+        if end > self._slot_size:
+            self._new_ring(max(end, 2 * self._slot_size), self._mv[:self._have])
+        mv = self._mv
+        while self._have < end:
+            got = os.readv(self._fd, [mv[self._have:]])  # whatever the pipe has
+            if not got:
+                return False
+            self._have += got
+        return True
+
+    def _advance(self, off: int):
+        # Frame ends at off; carry what was read past it over to the next slot
+        self._slot = (self._slot + 1) % self.RING_SLOTS
+        base = self._slot * self._slot_size
+        nxt = self._ring_mv[base:base + self._slot_size]
+        tail = self._have - off
+        nxt[:tail] = self._mv[off:self._have]
+        self._mv, self._have = nxt, tail
+
+    def next_png(self) -> Optional[memoryview]:
+        return self._fetched()
 
-        sig = read(8)
-        if not sig:
+    def _fetch(self) -> Optional[memoryview]:
+        if self.p.stdout is None:
             return None
-        if sig != b"\x89PNG\r\n\x1a\n":
-            # rare desync; drop until next loop frame
+        if not self._fill(8):
+            return None
+        mv = self._mv
+        if mv[:8] != b"\x89PNG\r\n\x1a\n":
+            # rare desync; drop up to the next signature (or all but a partial one)
+            i = self._ring.find(b"\x89PNG\r\n\x1a\n", self._slot * self._slot_size + 1,
+                                self._slot * self._slot_size + self._have)
+            self._advance(i - self._slot * self._slot_size if i >= 0 else max(0, self._have - 7))
             return None
 
-        buf = io.BytesIO()
-        buf.write(sig)
+        off = 8
         while True:
-            raw_len = read(4)
-            if not raw_len:
+            if not self._fill(off + 8):  # length + type
                 return None
-            length = int.from_bytes(raw_len, "big")
-            ctype = read(4)
-            data = read(length)
-            crc = read(4)
-            if not ctype or not data or not crc:
+            mv = self._mv  # _fill may have moved the frame to a bigger ring
+            (length,) = _U32.unpack_from(mv, off)
+            ctype = mv[off + 4:off + 8]
+            if not self._fill(off + length + 12):  # data + crc together
                 return None
-            buf.write(raw_len); buf.write(ctype); buf.write(data); buf.write(crc)
+            mv = self._mv
+            off += length + 12
             if ctype == b"IEND":
-                return buf.getvalue()
+                png = mv[:off]
+                self._size = _IHDR.unpack_from(png, 16)
+                self._advance(off)
+                return png
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        png = self.next_png()
+        if png is None:
+            return None
+        return self._decode_cached(png)
+
+    _next_if_changed = _FrameSource._png_if_changed
 
     def close(self): self.p.terminate()
     def __enter__(self): return self
     def __exit__(self, exc_type, exc, tb): self.close()
 
 
-def decode_png(png_bytes: bytes):
-    """PNG bytes -> cv2 BGR image"""
+class RawFrameStream(_StreamSource):
+    """
+    Continuous raw framebuffer reader, skipping PNG encode/decode entirely:
+    adb exec-out sh -c 'while :; do screencap; done'
+    Every frame is a little-endian header (width, height, format[, colorspace])
+    followed by width*height*4 RGBA bytes. The colorspace word exists from
+    Android 9 on; pass header_size=12 for older devices.
+    next_frame() returns a BGR mat that is overwritten by the following call.
+    """
+    _RGBA_FORMATS = (1, 2)  # RGBA_8888, RGBX_8888
+
+    def __init__(self, adb: str = "adb", serial: Optional[str] = None, header_size: int = 16):
+        args = [adb] + (["-s", serial] if serial else []) + \
+               ["exec-out", "sh", "-c", "while :; do screencap; done"]
+        self.p = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._hdr = bytearray(header_size)
+        self._raw: Optional[bytearray] = None
+        self._rgba: Optional[np.ndarray] = None
+        self._bgr: Optional[np.ndarray] = None
+
+    def _read_exact(self, mv: memoryview) -> bool:
+        out = self.p.stdout
+        got, total = 0, len(mv)
+        while got < total:
+            n = out.readinto(mv[got:])
+            if not n:
+                return False
+            got += n
+        return True
+
+    def _fetch(self) -> bool:
+        # Header + payload into self._raw; the BGR conversion is left to next_frame
+        if self.p.stdout is None or not self._read_exact(memoryview(self._hdr)):
+            return False
+        w, h, fmt = struct.unpack_from("<III", self._hdr)
+        if fmt not in self._RGBA_FORMATS or not w or not h:
+            raise RuntimeError(f"Unsupported screencap format {fmt} ({w}x{h})")
+        self._size = (w, h)
+        if self._rgba is None or self._rgba.shape[:2] != (h, w):
+            self._raw = bytearray(w * h * 4)
+            self._rgba = np.frombuffer(self._raw, dtype=np.uint8).reshape(h, w, 4)
+            self._bgr = np.empty((h, w, 3), dtype=np.uint8)
+        return self._read_exact(memoryview(self._raw))
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        if not self._fetched():
+            return None
+        return cv2.cvtColor(self._rgba, cv2.COLOR_RGBA2BGR, dst=self._bgr)
+
+    def close(self): self.p.terminate()
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): self.close()
+
+
+class ShellFrameSource(_FrameSource):
+    """
+    Frames fetched on demand through a ShellSession instead of a continuously
+    running screencap loop, so the device only encodes frames we actually read.
+    Drop-in for PngStream/RawFrameStream; raw=True skips PNG on both ends.
+    """
+    def __init__(self, sh: ShellSession, raw: bool = False):
+        self.sh = sh
+        self.raw = raw
+        self.decoder = new_png_decoder()
+        self._bgr: Optional[np.ndarray] = None
+
+    def next_png(self) -> Optional[bytes]:
+        png = self.sh.capture_frame()
+        if not png.startswith(b"\x89PNG\r\n\x1a\n") or len(png) < 24:
+            return None
+        self._size = _IHDR.unpack_from(png, 16)
+        return png
+
+    def _next_if_changed(self, prev_hash, gray=False):
+        if self.raw:
+            return super()._next_if_changed(prev_hash, gray)
+        return self._png_if_changed(prev_hash, gray)
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        if not self.raw:
+            png = self.next_png()
+            return None if png is None else self._decode_cached(png)
+        data = self.sh.capture_frame(raw=True)
+        if len(data) < 12:
+            return None
+        w, h, fmt = struct.unpack_from("<III", data)
+        hdr = len(data) - w * h * 4  # 12 or 16 depending on Android version
+        if fmt not in RawFrameStream._RGBA_FORMATS or hdr not in (12, 16):
+            return None
+        self._size = (w, h)
+        rgba = np.frombuffer(data, dtype=np.uint8, offset=hdr).reshape(h, w, 4)
+        if self._bgr is None or self._bgr.shape[:2] != (h, w):
+            self._bgr = np.empty((h, w, 3), dtype=np.uint8)
+        return cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGR, dst=self._bgr)
+
+    def close(self): pass
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): self.close()
+
+
+def digest64(buf) -> int:
+    """Cheap non-cryptographic digest of any buffer (bytes, memoryview, contiguous array)."""
+    if xxhash is not None:
+        return xxhash.xxh3_64_intdigest(buf)
+    return zlib.crc32(buf)
+
+
+class _SameFrame:
+    def __repr__(self): return "SAME_FRAME"
+
+# Returned by DedupPngStream.next_png() when the frame equals the previous one
+SAME_FRAME = _SameFrame()
+
+
+class DedupPngStream(_FrameSource):
+    """
+    Wraps PngStream/ShellFrameSource/RawFrameStream for callers that poll
+    next_png()/next_frame() themselves and want to know when a frame repeats,
+    which is most frames while the UI sits idle on an animation (next_changed()
+    already skips repeats on its own). next_png() returns SAME_FRAME for a
+    repeat; next_frame() sets .same so callers can reuse results they derived
+    from the previous mat. PNGs are decoded through the inner source's
+    _decode_cached with the digest taken here, so a repeat costs one hash and
+    no decode, and there is no second decoder or frame cache to keep in sync.
+    Raw sources (RawFrameStream, ShellFrameSource(raw=True)) are deduped on
+    the decoded buffer; the whole frame is hashed since a partial sample would
+    miss changes in the middle of the screen, and xxh3 does 8 MB in well under a ms.
+    """
+    def __init__(self, inner):
+        self.inner = inner
+        # ShellFrameSource has next_png in either mode; its raw flag picks the capture
+        self._png = hasattr(inner, "next_png") and not getattr(inner, "raw", False)
+        self.same = False
+        self._last_sig: Optional[int] = None
+
+    def _seen(self, sig: int) -> bool:
+        self.same = sig == self._last_sig
+        self._last_sig = sig
+        return self.same
+
+    def next_png(self) -> Union[bytes, memoryview, _SameFrame, None]:
+        png = self.inner.next_png()
+        if png is None:
+            return None
+        return SAME_FRAME if self._seen(digest64(png)) else png
+
+    def next_frame(self) -> Optional[np.ndarray]:
+        if not self._png:
+            frame = self.inner.next_frame()
+            if frame is not None:
+                self._seen(digest64(frame))
+            return frame
+        png = self.inner.next_png()
+        if png is None:
+            return None
+        h = digest64(png)
+        self._seen(h)
+        return self.inner._decode_cached(png, h)
+
+    def _next_if_changed(self, prev_hash, gray=False):
+        return self.inner._next_if_changed(prev_hash, gray)
+
+    def prefetch_next(self) -> bool:
+        return self.inner.prefetch_next()
+
+    def drop_prefetch(self) -> None:
+        self.inner.drop_prefetch()
+
+    def _frame_size(self) -> Tuple[int, int]:
+        return self.inner._frame_size()
+
+    def close(self): self.inner.close()
+    def __enter__(self): return self
+    def __exit__(self, exc_type, exc, tb): self.close()
+
+
+class PngDecoder:
+    """
+    PNG bytes -> cv2 BGR image (or gray with gray=True); the fallback when
+    libspng is missing. A plain wrapper over decode_png: the cv2 binding of
+    imdecode takes no dst, so every frame gets a fresh image. Buffer reuse
+    across frames comes from SpngDecoder only.
+    """
+    def decode(self, png_bytes, gray: bool = False) -> np.ndarray:
+        return decode_png(png_bytes, gray)
+
+
+class SpngDecoder:
+    """
+    PNG bytes -> cv2 BGR image via libspng, decoding into a persistent RGB
+    buffer (sized from the first frame, regrown on resolution change) and
+    swapping channels into a second persistent BGR buffer. No per-frame
+    allocation once warm. The returned array is overwritten by the next decode().
+    gray=True returns one luma plane instead: grayscale PNGs are decoded as
+    SPNG_FMT_G8 straight into it (libspng only offers G8 for those); color
+    ones are decoded to RGB and converted once, skipping the BGR buffer.
+    """
+    def __init__(self):
+        if _spng is None:
+            raise RuntimeError("libspng/cffi not available")
+        self._ihdr = _ffi.new("struct spng_ihdr *")
+        self._size = _ffi.new("size_t *")
+        self._rgb: Optional[np.ndarray] = None
+        self._bgr: Optional[np.ndarray] = None
+        self._gray: Optional[np.ndarray] = None
+
+    def _check(self, err: int):
+        if err:
+            raise RuntimeError("libspng: " + _ffi.string(_spng.spng_strerror(err)).decode())
+
+    def _decode_into(self, ctx, out: np.ndarray, fmt: int):
+        self._check(_spng.spng_decoded_image_size(ctx, fmt, self._size))
+        if self._size[0] != out.nbytes:
+            raise RuntimeError("libspng: unexpected decoded size")
+        self._check(_spng.spng_decode_image(ctx, _ffi.from_buffer(out, require_writable=True),
+                                            out.nbytes, fmt, 0))
+
+    def decode(self, png_bytes, gray: bool = False) -> np.ndarray:
+        ctx = _spng.spng_ctx_new(0)
+        if ctx == _ffi.NULL:
+            raise MemoryError("spng_ctx_new failed")
+        try:
+            self._check(_spng.spng_set_png_buffer(ctx, _ffi.from_buffer(png_bytes), len(png_bytes)))
+            self._check(_spng.spng_get_ihdr(ctx, self._ihdr))
+            h, w = self._ihdr.height, self._ihdr.width
+            if gray:
+                if self._gray is None or self._gray.shape != (h, w):
+                    self._gray = np.empty((h, w), dtype=np.uint8)
+                if self._ihdr.color_type == _PNG_GRAY and self._ihdr.bit_depth <= 8:
+                    self._decode_into(ctx, self._gray, SPNG_FMT_G8)
+                    return self._gray
+            if self._rgb is None or self._rgb.shape[:2] != (h, w):
+                self._rgb = np.empty((h, w, 3), dtype=np.uint8)
+                self._bgr = np.empty((h, w, 3), dtype=np.uint8)
+            self._decode_into(ctx, self._rgb, SPNG_FMT_RGB8)
+        finally:
+            _spng.spng_ctx_free(ctx)
+        if gray:
+            return cv2.cvtColor(self._rgb, cv2.COLOR_RGB2GRAY, dst=self._gray)
+        return cv2.cvtColor(self._rgb, cv2.COLOR_RGB2BGR, dst=self._bgr)
+
+
+def new_png_decoder() -> Union[SpngDecoder, PngDecoder]:
+    """SpngDecoder when libspng is installed, else the cv2-based PngDecoder."""
+    return SpngDecoder() if _spng is not None else PngDecoder()
+
+
+def decode_png(png_bytes, gray: bool = False) -> np.ndarray:
+    """PNG bytes (or memoryview, e.g. from PngStream.next_png) -> cv2 BGR image, or gray"""
     arr = np.frombuffer(png_bytes, dtype=np.uint8)
-    img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
+    img = cv2.imdecode(arr, cv2.IMREAD_GRAYSCALE if gray else cv2.IMREAD_COLOR)
     if img is None:
         raise RuntimeError("Failed to decode PNG frame")
     return img
@@ -1,38 +1,89 @@
 # pogo_adb.py
 import re
 import subprocess
-from typing import Optional, Tuple
+import time
+from typing import Dict, List, Optional, Tuple
+
+from io_fast import ShellSession
+
+# Physical screen size never changes for a device; keyed by serial.
+_WM_SIZE_CACHE: Dict[Optional[str], Tuple[int, int]] = {}
+
+# Package of the resumed activity, e.g. "mResumedActivity: ActivityRecord{... u0 pkg/.Act t12}"
+_TOP_RE = re.compile(r"ResumedActivity.*?(\S+)/")
+# serial -> (monotonic timestamp, top package or "")
+_TOP_CACHE: Dict[Optional[str], Tuple[float, str]] = {}
+
+def _serial_key(serial: Optional[str], sh: Optional[ShellSession]) -> Optional[str]:
+    return sh.serial if sh is not None else serial
 
 def _adb(args, adb: str = "adb", serial: Optional[str] = None, text: bool = True):
     base = [adb] + (["-s", serial] if serial else [])
     return subprocess.run(base + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=text)
 
-def start_app(pkg: str, activity: str, *, adb: str = "adb", serial: Optional[str] = None):
-    _adb(["shell", "am", "start", "-n", f"{pkg}/{activity}"], adb, serial)
+def _shell(cmd: List[str], adb: str = "adb", serial: Optional[str] = None,
+           sh: Optional[ShellSession] = None) -> str:
+    """Run a shell command, over the persistent session when one is given."""
+    if sh is not None:
+        return sh.run_capture(" ".join(cmd))
+    return _adb(["shell"] + cmd, adb, serial).stdout or ""
+
+def start_app(pkg: str, activity: str, *, adb: str = "adb", serial: Optional[str] = None,
+              sh: Optional[ShellSession] = None):
+    _TOP_CACHE.pop(_serial_key(serial, sh), None)
+    _shell(["am", "start", "-n", f"{pkg}/{activity}"], adb, serial, sh)
+
+def top_package(*, adb: str = "adb", serial: Optional[str] = None,
+                sh: Optional[ShellSession] = None, max_age: float = 0.0) -> str:
+    """Package of the resumed activity ("" if unknown); answers up to max_age seconds old are reused."""
+    key = _serial_key(serial, sh)
+    cached = _TOP_CACHE.get(key)
+    now = time.monotonic()
+    if cached is not None and now - cached[0] < max_age:
+        return cached[1]
+    out = _shell(["dumpsys", "activity", "activities", "|",
+                  "grep", "-m1", "-E", "'mResumedActivity|topResumedActivity'"], adb, serial, sh)
+    m = _TOP_RE.search(out)
+    top = m.group(1) if m else ""
+    _TOP_CACHE[key] = (now, top)
+    return top
 
-def is_foreground(pkg: str, *, adb: str = "adb", serial: Optional[str] = None) -> bool:
-    out = _adb(["shell", "dumpsys", "window", "windows"], adb, serial).stdout or ""
-    return pkg in out
+def is_foreground(pkg: str, *, adb: str = "adb", serial: Optional[str] = None,
+                  sh: Optional[ShellSession] = None, max_age: float = 0.0) -> bool:
+    return top_package(adb=adb, serial=serial, sh=sh, max_age=max_age) == pkg
 
-def am_force_stop(pkg: str, *, adb: str = "adb", serial: Optional[str] = None):
-    _adb(["shell", "am", "force-stop", pkg], adb, serial)
+def am_force_stop(pkg: str, *, adb: str = "adb", serial: Optional[str] = None,
+                  sh: Optional[ShellSession] = None):
+    _TOP_CACHE.pop(_serial_key(serial, sh), None)
+    _shell(["am", "force-stop", pkg], adb, serial, sh)
 
-def monkey_launch(pkg: str, *, adb: str = "adb", serial: Optional[str] = None):
-    _adb(["shell", "monkey", "-p", pkg, "-c", "android.intent.category.LAUNCHER", "1"], adb, serial)
+def monkey_launch(pkg: str, *, adb: str = "adb", serial: Optional[str] = None,
+                  sh: Optional[ShellSession] = None):
+    _TOP_CACHE.pop(_serial_key(serial, sh), None)
+    _shell(["monkey", "-p", pkg, "-c", "android.intent.category.LAUNCHER", "1"], adb, serial, sh)
 
-def close_system_dialogs(*, adb: str = "adb", serial: Optional[str] = None):
-    _adb(["shell", "am", "broadcast", "-a", "android.intent.action.CLOSE_SYSTEM_DIALOGS"], adb, serial)
+def close_system_dialogs(*, adb: str = "adb", serial: Optional[str] = None,
+                         sh: Optional[ShellSession] = None):
+    _shell(["am", "broadcast", "-a", "android.intent.action.CLOSE_SYSTEM_DIALOGS"], adb, serial, sh)
 
-def wm_size(*, adb: str = "adb", serial: Optional[str] = None) -> Tuple[int, int]:
-    out = _adb(["shell", "wm", "size"], adb, serial).stdout or ""
+def wm_size(*, adb: str = "adb", serial: Optional[str] = None,
+            sh: Optional[ShellSession] = None) -> Tuple[int, int]:
+    key = _serial_key(serial, sh)
+    if key in _WM_SIZE_CACHE:
+        return _WM_SIZE_CACHE[key]
+    out = _shell(["wm", "size"], adb, serial, sh)
     m = re.search(r"Physical size:\s*(\d+)x(\d+)", out)
     if not m:
         raise RuntimeError("Failed to get wm size")
-    return int(m.group(1)), int(m.group(2))
+    _WM_SIZE_CACHE[key] = size = (int(m.group(1)), int(m.group(2)))
+    return size
 
-def stay_awake_usb(enable: bool, *, adb: str = "adb", serial: Optional[str] = None):
-    _adb(["shell", "svc", "power", "stayon", "usb" if enable else "false"], adb, serial)
+def stay_awake_usb(enable: bool, *, adb: str = "adb", serial: Optional[str] = None,
+                   sh: Optional[ShellSession] = None):
+    _shell(["svc", "power", "stayon", "usb" if enable else "false"], adb, serial, sh)
 
-def lock_orientation_portrait(*, adb: str = "adb", serial: Optional[str] = None):
-    _adb(["shell", "settings", "put", "system", "accelerometer_rotation", "0"], adb, serial)
-    _adb(["shell", "settings", "put", "system", "user_rotation", "0"], adb, serial)
+def lock_orientation_portrait(*, adb: str = "adb", serial: Optional[str] = None,
+                              sh: Optional[ShellSession] = None):
+    # Both settings in one shell round trip
+    _shell(["settings", "put", "system", "accelerometer_rotation", "0", ";",
+            "settings", "put", "system", "user_rotation", "0"], adb, serial, sh)
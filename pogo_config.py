@@ -91,7 +91,7 @@ default definition to match your own captured templates.
 """
 
 from dataclasses import dataclass
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
 # Constants
 PKG = "com.nianticlabs.pokemongo"
@@ -99,9 +99,21 @@ ACTIVITY = "com.nianticproject.holoholo.libholoholo.unity.UnityMainActivity"
 
 @dataclass(frozen=True)
 class Locator:
-    """Represents an on-screen anchor image and its match threshold."""
+    """Represents an on-screen anchor image and its match threshold.
+
+    ``roi`` optionally bounds the search to a screen-percentage rectangle
+    (x, y, w, h), like ``SignatureRects``; ``None`` searches the whole frame.
+
+    ``match_mode`` picks the comparison: ``"ncc"`` (normalized correlation,
+    tolerant of brightness changes) or ``"sad"`` for opaque icons that look the
+    same on every screen.  ``"sad"`` scores the absolute pixel difference
+    (1 - RMS difference / 255), so ``thresh`` is not normalized per window and
+    wants to be stricter than the NCC default (around 0.95).
+    """
     file: str
     thresh: float = 0.86
+    roi: Optional[Tuple[float, float, float, float]] = None
+    match_mode: str = "ncc"
 
 
 @dataclass(frozen=True)
@@ -112,6 +124,29 @@ class Swipe:
     duration_ms: int = 280
 
 
+@dataclass(frozen=True)
+class CompiledUi:
+    """Pixel coordinates derived from a ``UiPack`` for one screen size.
+
+    ``swipes`` maps each swipe name to ``(x1, y1, x2, y2, duration_ms)`` and
+    ``center_tap`` is the point tapped to advance the appraisal.  Built by
+    ``UiPack.compile_for``.
+    """
+    width: int
+    height: int
+    swipes: Dict[str, Tuple[int, int, int, int, int]]
+    center_tap: Tuple[int, int]
+
+
+# Screen-percentage point tapped to step through (and close) the appraisal
+CENTER_TAP = (0.5, 0.65)
+
+
+def center_tap_for(width: int, height: int) -> Tuple[int, int]:
+    """``CENTER_TAP`` in pixels for a width x height screen."""
+    return int(width * CENTER_TAP[0]), int(height * CENTER_TAP[1])
+
+
 @dataclass(frozen=True)
 class SignatureRects:
     """Regions used to generate signatures for detecting end of lists (CP and weight)."""
@@ -345,6 +380,15 @@ class UiPack:
     waits: Waits
     sig_rects: SignatureRects
 
+    def compile_for(self, width: int, height: int) -> CompiledUi:
+        """Resolve the percentage swipes and the center tap to pixels for a width x height screen."""
+        swipes = {
+            name: (int(width * sw.start[0]), int(height * sw.start[1]),
+                   int(width * sw.end[0]), int(height * sw.end[1]), sw.duration_ms)
+            for name, sw in self.swipes.items()
+        }
+        return CompiledUi(width, height, swipes, center_tap_for(width, height))
+
 
 def default_pack(asset_dir: str = "./assets") -> UiPack:
     """Return a UiPack with placeholder template names and sensible defaults.
@@ -359,18 +403,18 @@ def default_pack(asset_dir: str = "./assets") -> UiPack:
     return UiPack(
         asset_dir=asset_dir,
         top_bar=TopBarUI(
-            weather=Locator("weather_icon.png"),
-            compass=Locator("compass_icon.png"),
+            weather=Locator("weather_icon.png", roi=(0.5, 0.0, 0.5, 0.15)),
+            compass=Locator("compass_icon.png", roi=(0.5, 0.0, 0.5, 0.25)),
             campfire=Locator("campfire_icon.png"),
             bluetooth=Locator("bluetooth_icon.png"),
             bonuses=Locator("bonuses_icon.png"),
             rocket_radar=Locator("rocket_radar_icon.png"),
             daily_incense=Locator("daily_incense_icon.png"),
             today_view=Locator("today_view_icon.png"),
-            nearby=Locator("nearby_icon.png"),
-            main_menu=Locator("main_menu_icon.png"),
+            nearby=Locator("nearby_icon.png", roi=(0.6, 0.8, 0.4, 0.2)),
+            main_menu=Locator("main_menu_icon.png", roi=(0.3, 0.8, 0.4, 0.2)),
             buddy=Locator("buddy_icon.png"),
-            trainer=Locator("trainer_icon.png"),
+            trainer=Locator("trainer_icon.png", roi=(0.0, 0.8, 0.4, 0.2)),
         ),
         weather_menu=WeatherMenuUI(
             report_issue=Locator("weather_report_button.png"),
@@ -435,15 +479,15 @@ def default_pack(asset_dir: str = "./assets") -> UiPack:
             battle_party=Locator("battle_menu_party.png"),
         ),
         appraise_menu=AppraiseMenuUI(
-            three_bars=Locator("hamburger_icon.png"),
+            three_bars=Locator("hamburger_icon.png", roi=(0.5, 0.75, 0.5, 0.25)),
             appraise_btn=Locator("appraise_button.png"),
             tag_btn=Locator("tag_button.png"),
             tag_three_star=Locator("tag_three_star.png"),
-            tag_close=Locator("tag_close.png"),
+            tag_close=Locator("tag_close.png", roi=(0.7, 0.05, 0.3, 0.15)),
             three_stars_badge=Locator("three_stars_badge.png", 0.88),
         ),
         pokemon_list=PokemonListUI(
-            first_pokemon_anchor=Locator("first_pokemon_anchor.png"),
+            first_pokemon_anchor=Locator("first_pokemon_anchor.png", roi=(0.0, 0.1, 0.5, 0.4)),
             sort_button=Locator("sort_button.png"),
             sort_by_cp=Locator("sort_by_cp.png"),
             sort_by_name=Locator("sort_by_name.png"),
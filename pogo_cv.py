@@ -1,60 +1,550 @@
 # pogo_cv.py
 import hashlib
+import itertools
 import os
-from typing import Optional, Tuple, Iterable
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Iterable
 
 import cv2
 import numpy as np
 from pogo_config import UiPack, Locator
 
+try:
+    import xxhash
+except ImportError:  # optional; signatures fall back to blake2b
+    xxhash = None
+
+try:
+    from numba import njit, prange
+except ImportError:  # optional; _pick_best then runs as plain Python, dhash via cv2
+    njit = None
+    prange = range
+
+# matchTemplate releases the GIL, so several locators are matched in parallel from
+# Python threads. OpenCV is held to one thread only while such a fan-out runs, so
+# the two don't oversubscribe; single-locator probes keep OpenCV's own threading.
+_POOL = ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+_FANOUT_LOCK = threading.Lock()
+
+@contextmanager
+def _fanout():
+    # setNumThreads is process-wide, hence the lock: one fan-out at a time
+    with _FANOUT_LOCK:
+        n = cv2.getNumThreads()
+        cv2.setNumThreads(1)
+        try:
+            yield
+        finally:
+            cv2.setNumThreads(n)
+
+class IdCache:
+    """
+    Values derived from objects that are unhashable or slow to hash (arrays,
+    UiPack), keyed by id(obj) plus any extra key parts. Each entry holds obj
+    itself, so its id can't be reused while the entry lives, and a hit must be
+    that same object. Cleared once it outgrows max_size (ad-hoc objects from
+    direct callers).
+    """
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self._d: Dict[tuple, tuple] = {}
+
+    def get(self, obj, *key, make: Callable[[], object]):
+        k = (id(obj),) + key
+        hit = self._d.get(k)
+        if hit is None or hit[0] is not obj:
+            if len(self._d) >= self.max_size:
+                self._d.clear()
+            hit = self._d[k] = (obj, make())
+        return hit[1]
+
+# Optional CUDA path (dev workstation); the phone loop keeps the CPU path.
+try:
+    _HAS_CUDA = cv2.cuda.getCudaEnabledDeviceCount() > 0
+except (AttributeError, cv2.error):
+    _HAS_CUDA = False
+if _HAS_CUDA:
+    _MATCHERS = {m: cv2.cuda.createTemplateMatching(cv2.CV_8UC1, m)
+                 for m in (cv2.TM_CCOEFF_NORMED, cv2.TM_SQDIFF_NORMED, cv2.TM_SQDIFF)}
+    _CUDA_LOCK = threading.Lock()  # matchers are shared by the find_any threads
+    _GPU_TPL_CACHE = IdCache()  # template -> uploaded GpuMat
+    # Persistent device buffers: pyramid level -> upload target (+ owning pyramid
+    # serial), and method -> correlation result. Guarded by _CUDA_LOCK.
+    _GPU_LEVELS: Dict[int, "cv2.cuda.GpuMat"] = {}
+    _GPU_LEVEL_OWNER: Dict[int, int] = {}
+    _GPU_RESULTS: Dict[int, "cv2.cuda.GpuMat"] = {}
+
 def _tpl_path(cfg: UiPack, loc: Locator) -> str:
     return os.path.join(cfg.asset_dir, loc.file)
 
+# Decoded templates keyed by path. matchTemplate only reads them, so sharing is safe.
+_TPL_CACHE: Dict[str, np.ndarray] = {}
+_TPL_GRAY_CACHE: Dict[str, np.ndarray] = {}
+# path -> (mean, std) of the gray template, computed once at load
+_TPL_STATS: Dict[str, Tuple[float, float]] = {}
+# Below this std (gray levels) a template is flat and zero-mean NCC is undefined
+_FLAT_STD = 1.0
+
 def load_template(cfg: UiPack, loc: Locator) -> np.ndarray:
     path = _tpl_path(cfg, loc)
+    img = _TPL_CACHE.get(path)
+    if img is not None:
+        return img
     img = cv2.imread(path, cv2.IMREAD_COLOR)
     if img is None:
         raise FileNotFoundError(f"Missing template: {path}")
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    mean, std = cv2.meanStdDev(gray)
+    _TPL_CACHE[path] = img
+    _TPL_GRAY_CACHE[path] = gray
+    _TPL_STATS[path] = (float(mean[0, 0]), float(std[0, 0]))
     return img
 
-def match_template(scr: np.ndarray, tpl: np.ndarray, thresh: float,
-                   scales: Iterable[float] = (1.0, 0.9, 1.1, 0.8, 1.2)) \
+def load_template_gray(cfg: UiPack, loc: Locator) -> np.ndarray:
+    path = _tpl_path(cfg, loc)
+    if path not in _TPL_GRAY_CACHE:
+        load_template(cfg, loc)
+    return _TPL_GRAY_CACHE[path]
+
+def template_method(cfg: UiPack, loc: Locator) -> int:
+    """TM_SQDIFF for match_mode "sad"; else TM_CCOEFF_NORMED, or TM_SQDIFF_NORMED for flat templates NCC can't score."""
+    if loc.match_mode == "sad":
+        return cv2.TM_SQDIFF
+    if loc.match_mode != "ncc":
+        raise ValueError(f"Unknown match_mode {loc.match_mode!r} for {loc.file}")
+    load_template_gray(cfg, loc)
+    _, std = _TPL_STATS[_tpl_path(cfg, loc)]
+    return cv2.TM_SQDIFF_NORMED if std < _FLAT_STD else cv2.TM_CCOEFF_NORMED
+
+def screen_to_gray(screen: np.ndarray) -> np.ndarray:
+    """Convert a frame to grayscale once so every locator can match against it."""
+    if screen.ndim == 2:
+        return screen
+    code = cv2.COLOR_BGRA2GRAY if screen.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+    return cv2.cvtColor(screen, code)
+
+def _iter_locators(node) -> Iterable[Locator]:
+    if isinstance(node, Locator):
+        yield node
+    elif is_dataclass(node):
+        for f in fields(node):
+            yield from _iter_locators(getattr(node, f.name))
+
+def preload_templates(cfg: UiPack) -> int:
+    """Decode every template referenced by cfg up front; missing files are skipped."""
+    n = 0
+    for loc in _iter_locators(cfg):
+        try:
+            load_template(cfg, loc)
+            n += 1
+        except FileNotFoundError:
+            pass
+    return n
+
+_PYR_SERIAL = itertools.count(1)
+
+class ScreenPyramid(list):
+    """
+    List of pyramid levels that also uploads each level to the GPU once, on first use.
+    Uploads go into persistent per-level GpuMats, so only the newest pyramid's
+    GPU copy is resident; an older pyramid transparently re-uploads if touched.
+    ROI crops (see _crop_pyramid) keep a parent and use GpuMat views of its levels.
+    """
+    def __init__(self, levels: Iterable[np.ndarray] = (), parent: Optional["ScreenPyramid"] = None):
+        super().__init__(levels)
+        self._serial = next(_PYR_SERIAL)
+        self._parent = parent
+        self._bounds: List[Tuple[int,int,int,int]] = []  # (y0, y1, x0, x1) in the parent level
+
+    def gpu_level(self, lvl: int) -> "cv2.cuda.GpuMat":
+        if self._parent is not None:
+            y0, y1, x0, x1 = self._bounds[lvl]
+            return self._parent.gpu_level(lvl).rowRange(y0, y1).colRange(x0, x1)
+        g = _GPU_LEVELS.get(lvl)
+        if g is None:
+            g = _GPU_LEVELS[lvl] = cv2.cuda.GpuMat()
+        if _GPU_LEVEL_OWNER.get(lvl) != self._serial:
+            g.upload(np.ascontiguousarray(self[lvl]))  # reallocates only on size change
+            _GPU_LEVEL_OWNER[lvl] = self._serial
+        return g
+
+def build_screen_pyramid(scr: np.ndarray, levels: int = 3) -> List[np.ndarray]:
+    """Gaussian pyramid of the (grayscale) screen; level l is 2**-l of the full resolution."""
+    pyr = ScreenPyramid([scr])
+    for _ in range(1, levels):
+        pyr.append(cv2.pyrDown(pyr[-1]))
+    return pyr
+
+def _pyramid_level(pyr: Sequence[np.ndarray], s: float) -> int:
+    # Coarsest level that is still at least as large as the requested screen scale.
+    lvl = 0
+    while lvl + 1 < len(pyr) and 2.0 ** -(lvl + 1) >= s:
+        lvl += 1
+    return lvl
+
+def _crop_pyramid(pyr: Sequence[np.ndarray], roi: Tuple[float,float,float,float]) \
+                  -> Tuple["ScreenPyramid", Tuple[int,int]]:
+    # Snap the crop origin to the coarsest level so every level shares one offset.
+    x, y, w, h = roi
+    top = len(pyr) - 1
+    Hc, Wc = pyr[top].shape[:2]
+    cx0 = int(Wc * x); cy0 = int(Hc * y)
+    out = ScreenPyramid(parent=pyr if isinstance(pyr, ScreenPyramid) else None)
+    for lvl, img in enumerate(pyr):
+        H, W = img.shape[:2]
+        k = 2 ** (top - lvl)
+        x0 = cx0 * k; y0 = cy0 * k
+        x1 = min(W, int(W * (x + w))); y1 = min(H, int(H * (y + h)))
+        out.append(img[y0:y1, x0:x1])
+        out._bounds.append((y0, y1, x0, x1))
+    return out, (cx0 * 2 ** top, cy0 * 2 ** top)
+
+def _upload(img: np.ndarray) -> "cv2.cuda.GpuMat":
+    g = cv2.cuda.GpuMat()
+    g.upload(np.ascontiguousarray(img))
+    return g
+
+def _gpu_template(t: np.ndarray) -> "cv2.cuda.GpuMat":
+    return _GPU_TPL_CACHE.get(t, make=lambda: _upload(t))
+
+# (template, w, h) -> resized; gives the GPU cache stable template objects
+# and spares re-resizing the same template every frame.
+_TPL_SCALED = IdCache()
+
+def _scaled_template(tpl: np.ndarray, k: float) -> np.ndarray:
+    th, tw = tpl.shape[:2]
+    size = (max(1, int(round(tw * k))), max(1, int(round(th * k))))
+    return _TPL_SCALED.get(tpl, *size, make=lambda: cv2.resize(
+        tpl, size, interpolation=cv2.INTER_AREA if k < 1 else cv2.INTER_LINEAR))
+
+def _peak(pyr: Sequence[np.ndarray], lvl: int, t: np.ndarray, method: int,
+          win: Optional[Tuple[int,int,int,int]] = None) -> Tuple[float, Tuple[int,int]]:
+    """Best (score, loc) of t on pyramid level lvl; score is "higher is better" for both methods.
+
+    win = (y0, y1, x0, x1) restricts the search to that window of the level;
+    the returned loc is still in level coordinates.
+    """
+    y0, y1, x0, x1 = win if win is not None else (0, pyr[lvl].shape[0], 0, pyr[lvl].shape[1])
+    if _HAS_CUDA:
+        with _CUDA_LOCK:
+            g = pyr.gpu_level(lvl) if isinstance(pyr, ScreenPyramid) else _upload(pyr[lvl])
+            if win is not None:
+                g = g.rowRange(y0, y1).colRange(x0, x1)
+            gres = _GPU_RESULTS.get(method)
+            if gres is None:
+                gres = _GPU_RESULTS[method] = cv2.cuda.GpuMat()
+            _MATCHERS[method].match(g, _gpu_template(t), gres)
+            min_val, max_val, min_loc, max_loc = cv2.cuda.minMaxLoc(gres)
+    else:
+        res = cv2.matchTemplate(pyr[lvl][y0:y1, x0:x1], t, method)
+        min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
+    if method == cv2.TM_SQDIFF_NORMED:
+        return 1.0 - min_val, (min_loc[0] + x0, min_loc[1] + y0)
+    if method == cv2.TM_SQDIFF:
+        # Absolute: 1 - RMS pixel difference over the full gray range
+        rms = np.sqrt(max(min_val, 0.0) / (t.size * 255.0 ** 2))
+        return 1.0 - float(rms), (min_loc[0] + x0, min_loc[1] + y0)
+    return max_val, (max_loc[0] + x0, max_loc[1] + y0)
+
+# Coarse-to-fine: a scale is first matched two pyramid levels down (1/16 of the
+# pixels) and only refined at its own level, in a window around the coarse peak,
+# when the coarse score clears thresh * _COARSE_RATIO * the template's coarse
+# floor (see _coarse_template). Templates too small, or too thin-stroked, for the
+# coarse level to see are matched directly instead.
+_COARSE_STEP = 2
+_COARSE_RATIO = 0.9
+_COARSE_MIN = 6         # coarse template side, px
+_COARSE_MIN_FLOOR = 0.5
+# Coarse px trimmed per side: two pyrDowns spread a full-res pixel over +-6 px
+_COARSE_PAD = 2
+# (template, method) -> (coarse template or None, floor)
+_COARSE_CAL = IdCache()
+
+def _coarse_score(res: np.ndarray, ct: np.ndarray, method: int) -> float:
+    min_val, max_val, _, _ = cv2.minMaxLoc(res)
+    if method == cv2.TM_SQDIFF_NORMED:
+        return 1.0 - min_val
+    if method == cv2.TM_SQDIFF:
+        return 1.0 - float(np.sqrt(max(min_val, 0.0) / (ct.size * 255.0 ** 2)))
+    return max_val
+
+def _coarse_template(t: np.ndarray, method: int) -> Tuple[Optional[np.ndarray], float]:
+    """
+    (coarse template, floor) for t. The coarse template is t pyrDown'ed like the
+    screen with _COARSE_PAD px trimmed off each side, so that it never depends on
+    pixels around the icon. The floor is its worst score on an exact copy of t
+    at each of the c x c alignments to the coarse grid: thin strokes blur away
+    at 1/4 resolution, so it can be far below 1. (None, 0) if it's too small.
+    """
+    return _COARSE_CAL.get(t, method, make=lambda: _calibrate_coarse(t, method))
+
+def _calibrate_coarse(t: np.ndarray, method: int) -> Tuple[Optional[np.ndarray], float]:
+    c = 2 ** _COARSE_STEP
+    p = _COARSE_PAD
+
+    def down(img):
+        for _ in range(_COARSE_STEP):
+            img = cv2.pyrDown(img)
+        return img
+
+    ct, floor = None, 0.0
+    small = down(t)
+    if min(small.shape[:2]) - 2 * p >= _COARSE_MIN:
+        ct = np.ascontiguousarray(small[p:-p, p:-p])
+        floor = 1.0
+        for dy in range(c):
+            for dx in range(c):
+                # The border only feeds the trimmed samples, so replicate is fine
+                canvas = cv2.copyMakeBorder(t, c + dy, 2 * c - dy, c + dx, 2 * c - dx, cv2.BORDER_REPLICATE)
+                floor = min(floor, _coarse_score(cv2.matchTemplate(down(canvas), ct, method), ct, method))
+    return ct, floor
+
+def _coarse_fine_peak(pyr: Sequence[np.ndarray], lvl: int, t: np.ndarray, method: int,
+                      thresh: float) -> Optional[Tuple[float, Tuple[int,int]]]:
+    """_peak via the coarse level; None when the coarse pass already rules the scale out."""
+    clvl = lvl + _COARSE_STEP
+    c = 2 ** _COARSE_STEP
+    if clvl >= len(pyr):
+        return _peak(pyr, lvl, t, method)
+    ct, floor = _coarse_template(t, method)
+    if ct is None or floor < _COARSE_MIN_FLOOR \
+            or ct.shape[0] > pyr[clvl].shape[0] or ct.shape[1] > pyr[clvl].shape[1]:
+        return _peak(pyr, lvl, t, method)
+    score, (cx, cy) = _peak(pyr, clvl, ct, method)
+    if score < thresh * _COARSE_RATIO * floor:
+        return None
+    H, W = pyr[lvl].shape[:2]
+    th, tw = t.shape[:2]
+    ox = (cx - _COARSE_PAD) * c; oy = (cy - _COARSE_PAD) * c  # template origin at lvl
+    # A coarse px spans c level px; allow the peak to shift by up to 4 of them,
+    # which also covers striped icons whose coarse peak slips by one period
+    m = 4 * c
+    x0 = max(0, ox - m); y0 = max(0, oy - m)
+    x1 = min(W, ox + tw + m); y1 = min(H, oy + th + m)
+    if x1 - x0 < tw or y1 - y0 < th:
+        return None
+    return _peak(pyr, lvl, t, method, (y0, y1, x0, x1))
+
+def _pick_best(vals: np.ndarray) -> int:
+    # Index of the best per-scale peak; vals holds -inf for skipped scales.
+    best = 0
+    for i in range(1, vals.shape[0]):
+        if vals[i] > vals[best]:
+            best = i
+    return best
+
+if njit is not None:
+    _pick_best = njit(cache=True)(_pick_best)
+
+def match_template(pyr: Sequence[np.ndarray], tpl: np.ndarray, thresh: float,
+                   scales: Iterable[float] = (1.0, 0.9, 1.1, 0.8, 1.2),
+                   early_margin: float = 0.03, method: int = cv2.TM_CCOEFF_NORMED) \
                    -> Optional[Tuple[int,int,int,int,float]]:
-    h, w = scr.shape[:2]
-    best = None
-    for s in scales:
-        rs = cv2.resize(scr, (max(1,int(w*s)), max(1,int(h*s))), interpolation=cv2.INTER_AREA if s<1 else cv2.INTER_LINEAR)
-        res = cv2.matchTemplate(rs, tpl, cv2.TM_CCOEFF_NORMED)
-        _, max_val, _, max_loc = cv2.minMaxLoc(res)
-        if best is None or max_val > best[-1]:
-            x, y = max_loc
-            th, tw = tpl.shape[:2]
-            bx0 = int(x / s); by0 = int(y / s)
-            bw = int(tw / s);  bh = int(th / s)
-            best = (bx0, by0, bw, bh, max_val)
-    if best and best[-1] >= thresh:
-        return best
+    """Multi-scale match of a grayscale tpl against a grayscale screen pyramid.
+
+    A scale s means "screen scaled by s". Scales that land on a pyramid level are
+    matched directly; the rest resize the (small) template instead of the screen.
+    method is TM_CCOEFF_NORMED (zero-mean NCC; OpenCV derives the window
+    statistics from integral images) or TM_SQDIFF_NORMED, scored as 1 - min so
+    that higher is better as with thresh, or TM_SQDIFF, scored as 1 - RMS
+    difference / 255 (no per-window normalization).
+    Runs on the GPU when OpenCV has CUDA, reusing the pyramid's uploaded levels.
+    Scales are tried in order (most likely first) and the sweep stops at the
+    first score >= thresh + early_margin. Each scale is screened on a 1/4
+    resolution level first and refined around the coarse peak (see
+    _coarse_fine_peak), so a miss costs about 1/16 of a full match.
+    """
+    scales = tuple(scales)
+    if not scales:
+        return None
+    # Per-scale peaks as full-res (x, y, w, h); reduced by _pick_best
+    vals = np.full(len(scales), -np.inf, dtype=np.float32)
+    boxes = np.zeros((len(scales), 4), dtype=np.int32)
+    for i, s in enumerate(scales):
+        lvl = _pyramid_level(pyr, s)
+        img = pyr[lvl]
+        f = 2 ** lvl                      # level px -> full-res px
+        k = 1.0 / (s * f)                 # template scale at this level
+        t = tpl if abs(k - 1.0) < 1e-6 else _scaled_template(tpl, k)
+        if t.shape[0] > img.shape[0] or t.shape[1] > img.shape[1]:
+            continue
+        peak = _coarse_fine_peak(pyr, lvl, t, method, thresh)
+        if peak is None:
+            continue
+        score, (x, y) = peak
+        if score >= thresh + early_margin:
+            return x * f, y * f, t.shape[1] * f, t.shape[0] * f, score
+        vals[i] = score
+        boxes[i] = (x * f, y * f, t.shape[1] * f, t.shape[0] * f)
+    i = _pick_best(vals)
+    score = float(vals[i])
+    if score >= thresh:
+        x, y, w, h = (int(v) for v in boxes[i])
+        return x, y, w, h, score
+    return None
+
+def find_locator(cfg: UiPack, loc: Locator, screen: np.ndarray,
+                 pyr: Optional[Sequence[np.ndarray]] = None,
+                 gray: Optional[np.ndarray] = None) -> Optional[Tuple[int,int,int,int,float]]:
+    """Pass gray (screen_to_gray of screen) or pyr (build_screen_pyramid of it) to share them across locators on one frame."""
+    tpl = load_template_gray(cfg, loc)
+    method = template_method(cfg, loc)
+    if pyr is None:
+        pyr = build_screen_pyramid(screen_to_gray(screen) if gray is None else gray)
+    if loc.roi is None:
+        return match_template(pyr, tpl, loc.thresh, method=method)
+    sub, (ox, oy) = _crop_pyramid(pyr, loc.roi)
+    hit = match_template(sub, tpl, loc.thresh, method=method)
+    if hit is None:
+        return None
+    x, y, w, h, score = hit
+    return x + ox, y + oy, w, h, score
+
+def find_any(cfg: UiPack, locs: Sequence[Locator], screen: np.ndarray,
+             pyr: Optional[Sequence[np.ndarray]] = None,
+             gray: Optional[np.ndarray] = None) \
+             -> Optional[Tuple[Locator, Tuple[int,int,int,int,float]]]:
+    """Match several locators concurrently; return the first (locator, bbox) that hits."""
+    if pyr is None:
+        pyr = build_screen_pyramid(screen_to_gray(screen) if gray is None else gray)
+    for loc in locs:
+        load_template_gray(cfg, loc)  # populate the cache before fanning out
+    with _fanout():
+        pending = {_POOL.submit(find_locator, cfg, loc, screen, pyr): loc for loc in locs}
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    loc = pending.pop(fut)
+                    hit = fut.result()
+                    if hit is not None:
+                        return loc, hit
+        finally:
+            for fut in pending:
+                fut.cancel()
     return None
 
-def find_locator(cfg: UiPack, loc: Locator, screen: np.ndarray) -> Optional[Tuple[int,int,int,int,float]]:
-    tpl = load_template(cfg, loc)
-    return match_template(screen, tpl, loc.thresh)
+def find_locators_batch(cfg: UiPack, locs: Sequence[Locator], frame_gray: np.ndarray,
+                        pyr: Optional[Sequence[np.ndarray]] = None) \
+                        -> Dict[Locator, Optional[Tuple[int,int,int,int,float]]]:
+    """Match every locator against one gray frame (one shared pyramid, in parallel); locator -> bbox or None."""
+    if pyr is None:
+        pyr = build_screen_pyramid(frame_gray)
+    for loc in locs:
+        load_template_gray(cfg, loc)
+    with _fanout():
+        futs = {loc: _POOL.submit(find_locator, cfg, loc, frame_gray, pyr) for loc in locs}
+        return {loc: fut.result() for loc, fut in futs.items()}
 
 def center_of(bbox: Tuple[int,int,int,int,float]) -> Tuple[int,int]:
     x, y, w, h, _ = bbox
     return x + w//2, y + h//2
 
+@dataclass(frozen=True)
+class ResolvedRects:
+    """Every percentage rect of a UiPack as integer (y0, y1, x0, x1) slices for one W x H."""
+    W: int
+    H: int
+    rects: Dict[str, Tuple[int,int,int,int]]
+
+    def crop(self, screen: np.ndarray, name: str) -> np.ndarray:
+        y0, y1, x0, x1 = self.rects[name]
+        return screen[y0:y1, x0:x1]
+
+def _is_rect(v) -> bool:
+    return isinstance(v, tuple) and len(v) == 4 and all(isinstance(c, (int, float)) for c in v)
+
+def _iter_rects(node, prefix: str = ""):
+    for f in fields(node):
+        v = getattr(node, f.name)
+        name = prefix + f.name
+        if _is_rect(v):
+            yield name, v
+        elif is_dataclass(v):
+            yield from _iter_rects(v, name + ".")
+
+def _resolve(rect: Tuple[float,float,float,float], W: int, H: int) -> Tuple[int,int,int,int]:
+    x, y, w, h = rect
+    return int(H * y), int(H * (y + h)), int(W * x), int(W * (x + w))
+
+def resolve_rects(cfg: UiPack, W: int, H: int) -> ResolvedRects:
+    """Resolve sig_rects, locator ROIs, ... once; keys are dotted paths like "sig_rects.cp"."""
+    return ResolvedRects(W, H, {name: _resolve(r, W, H) for name, r in _iter_rects(cfg)})
+
+# (cfg, W, H) -> rects; re-resolved automatically when the frame size changes
+# (orientation).
+_RECTS_CACHE = IdCache()
+
+def rects_for(cfg: UiPack, screen: np.ndarray) -> ResolvedRects:
+    H, W = screen.shape[:2]
+    return _RECTS_CACHE.get(cfg, W, H, make=lambda: resolve_rects(cfg, W, H))
+
 def crop_percent(screen: np.ndarray, rect: Tuple[float,float,float,float]) -> np.ndarray:
     H, W = screen.shape[:2]
     x, y, w, h = rect
     x0 = int(W * x); y0 = int(H * y); x1 = int(W * (x + w)); y1 = int(H * (y + h))
     return screen[y0:y1, x0:x1]
 
+# Resize target reused by every signature; they are computed one after another.
+_SIG_BUF = np.empty((90, 160, 3), dtype=np.uint8)
+
 def signature_bytes(img: np.ndarray) -> bytes:
-    small = cv2.resize(img, (160, 90), interpolation=cv2.INTER_AREA)
-    return hashlib.blake2b(small.tobytes(), digest_size=16).digest()
+    if img.ndim == 3 and img.shape[2] == 3 and img.dtype == np.uint8:
+        small = cv2.resize(img, (160, 90), dst=_SIG_BUF, interpolation=cv2.INTER_AREA)
+    else:
+        small = np.ascontiguousarray(cv2.resize(img, (160, 90), interpolation=cv2.INTER_AREA))
+    # Change detection only, no need for a cryptographic hash; both give 16 bytes.
+    # Both hash the array through the buffer protocol, so there is no tobytes() copy.
+    if xxhash is not None:
+        return xxhash.xxh3_128_digest(small)
+    return hashlib.blake2b(small, digest_size=16).digest()
+
+def signature_from_rect(screen: np.ndarray, rect: Tuple[float,float,float,float]) -> bytes:
+    return signature_bytes(crop_percent(screen, rect))
 
 def signatures_from_frame(cfg: UiPack, screen: np.ndarray) -> Tuple[bytes, bytes]:
-    cp = crop_percent(screen, cfg.sig_rects.cp)
-    wt = crop_percent(screen, cfg.sig_rects.weight)
-    return signature_bytes(cp), signature_bytes(wt)
+    R = rects_for(cfg, screen)
+    return (signature_bytes(R.crop(screen, "sig_rects.cp")),
+            signature_bytes(R.crop(screen, "sig_rects.weight")))
+
+def _dhash_rows(img: np.ndarray, out: np.ndarray):
+    # One pass over a BGR crop: gray + block mean on a 17x16 grid + the 16
+    # "right brighter than left" bits of each row, packed MSB first into out[r].
+    H, W = img.shape[0], img.shape[1]
+    for r in prange(16):
+        y0 = r * H // 16
+        y1 = max(y0 + 1, (r + 1) * H // 16)
+        prev = 0.0
+        bits = 0
+        for c in range(17):
+            x0 = c * W // 17
+            x1 = max(x0 + 1, (c + 1) * W // 17)
+            acc = 0.0
+            for y in range(y0, y1):
+                for x in range(x0, x1):
+                    acc += 0.114 * img[y, x, 0] + 0.587 * img[y, x, 1] + 0.299 * img[y, x, 2]
+            m = acc / ((y1 - y0) * (x1 - x0))
+            if c > 0:
+                bits = (bits << 1) | (1 if m > prev else 0)
+            prev = m
+        out[r] = bits
+
+if njit is not None:
+    _dhash_rows = njit(parallel=True, fastmath=True, cache=True)(_dhash_rows)
+
+def dhash(img: np.ndarray) -> bytes:
+    """16x16 difference hash (32 bytes): sign of the horizontal gradient on a 17x16 gray thumbnail.
+
+    With numba, BGR uint8 crops go through the fused _dhash_rows kernel, which
+    reads the crop once; otherwise cvtColor + INTER_AREA resize. The two round
+    differently, so only compare hashes produced by the same process.
+    """
+    if njit is not None and img.ndim == 3 and img.shape[2] >= 3 and img.dtype == np.uint8:
+        out = np.empty(16, dtype=np.uint16)
+        _dhash_rows(img, out)
+        return out.astype(">u2").tobytes()
+    g = cv2.resize(screen_to_gray(img), (17, 16), interpolation=cv2.INTER_AREA)
+    return np.packbits(g[:, 1:] > g[:, :-1]).tobytes()
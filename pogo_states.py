@@ -1,13 +1,16 @@
 # pogo_states.py
+from dataclasses import dataclass
 from enum import Enum, auto
 import time
+from typing import Callable, Dict, List, Optional, Tuple
 
 from io_fast import ShellSession, PngStream
-from pogo_config import UiPack, PKG, ACTIVITY  # assuming you export PKG/ACTIVITY in your config
+from pogo_config import UiPack, AppraiseMenuUI, Waits, PKG, ACTIVITY  # assuming you export PKG/ACTIVITY in your config
 from pogo_ui import (
-    tap_locator, exists, single_tap_center, swipe_by_name, end_of_list_after_swipe,
-    playing_pogo
+    tap_locator, locate_and_tap, tap_points, tap_then_find, exists, single_tap_center, swipe_by_name,
+    end_of_list_after_swipe, playing_pogo, wait_and_find_gray, wait_and_find_batch
 )
+from pogo_cv import center_of
 
 class Tag3StarState(Enum):
     OPEN_LIST = auto()
@@ -36,59 +39,108 @@ def select_first_pokemon(cfg: UiPack, sh: ShellSession, ps: PngStream):
     tap_locator(cfg, cfg.pokemon_list.first_pokemon_anchor, sh, ps, cfg.waits.after_open_detail)
 
 def open_appraise_flow(cfg: UiPack, sh: ShellSession, ps: PngStream):
-    tap_locator(cfg, cfg.appraise_menu.three_bars, sh, ps, cfg.waits.after_three_bars)
-    tap_locator(cfg, cfg.appraise_menu.appraise_btn, sh, ps, cfg.waits.after_open_appraise)
+    # The hamburger tap and the screencap that should show the Appraise button go
+    # out as one shell command; only fall back to polling the stream if it's not there.
+    am = cfg.appraise_menu
+    hit, _ = wait_and_find_gray(cfg, am.three_bars, ps, timeout=3.0)
+    btn = None
+    if hit is not None:
+        btn = tap_then_find(cfg, am.appraise_btn, sh, *center_of(hit), settle=cfg.waits.after_three_bars)
+    if btn is None:
+        tap_locator(cfg, am.appraise_btn, sh, ps, cfg.waits.after_open_appraise)
+    else:
+        x, y = center_of(btn)
+        tap_points(sh, [(x, y, int(cfg.waits.after_open_appraise * 1000))])
 
-def tag_three_star_once(cfg: UiPack, sh: ShellSession, ps: PngStream):
+def tag_three_star_once(cfg: UiPack, sh: ShellSession, ps: PngStream,
+                        taps: Optional[List[Tuple[int, int, int]]] = None) -> Optional[List[Tuple[int, int, int]]]:
     # open hamburger -> tag -> choose Three Star -> close
-    tap_locator(cfg, cfg.appraise_menu.three_bars, sh, ps, cfg.waits.after_three_bars)
-    tap_locator(cfg, cfg.appraise_menu.tag_btn, sh, ps, cfg.waits.after_tag_open)
-    tap_locator(cfg, cfg.appraise_menu.tag_three_star, sh, ps, cfg.waits.after_apply_tag)
-    tap_locator(cfg, cfg.appraise_menu.tag_close, sh, ps, cfg.waits.after_close_tag)
+    # Each button only appears after the previous tap, so the first run has to
+    # find them one by one. Their positions are fixed, though: the (x, y, delay_ms)
+    # taps are returned and later calls replay them in a single shell write.
+    if taps is not None:
+        tap_points(sh, taps)
+        return taps
+    steps = [
+        (cfg.appraise_menu.three_bars, cfg.waits.after_three_bars),
+        (cfg.appraise_menu.tag_btn, cfg.waits.after_tag_open),
+        (cfg.appraise_menu.tag_three_star, cfg.waits.after_apply_tag),
+        (cfg.appraise_menu.tag_close, cfg.waits.after_close_tag),
+    ]
+    found = []
+    for loc, wait_after in steps:
+        pt = locate_and_tap(cfg, loc, sh, ps, wait_after)
+        if pt is not None:
+            found.append((pt[0], pt[1], int(wait_after * 1000)))
+    return found if len(found) == len(steps) else None
+
+@dataclass
+class _Ctx:
+    """State shared by the tag_three_star_pass handlers; config lookups are hoisted in here once."""
+    cfg: UiPack
+    sh: ShellSession
+    ps: PngStream
+    am: AppraiseMenuUI
+    waits: Waits
+    tag_taps: Optional[List[Tuple[int, int, int]]] = None  # learned on the first tagged Pokémon, then replayed
+
+def _do_open_first(ctx: _Ctx) -> Tag3StarState:
+    select_first_pokemon(ctx.cfg, ctx.sh, ctx.ps)
+    return Tag3StarState.OPEN_MENU
+
+def _do_open_menu(ctx: _Ctx) -> Tag3StarState:
+    open_appraise_flow(ctx.cfg, ctx.sh, ctx.ps)
+    return Tag3StarState.TAP_TO_STATS
+
+def _do_tap_to_stats(ctx: _Ctx) -> Tag3StarState:
+    single_tap_center(ctx.sh, ctx.ps, ctx.waits.after_tap_advance)  # enter stats in appraise
+    return Tag3StarState.EVAL_STARS
+
+def _do_eval_stars(ctx: _Ctx) -> Tag3StarState:
+    if exists(ctx.cfg, ctx.am.three_stars_badge, ctx.ps, timeout=1.0):
+        # exit appraise (one tap) then tag
+        single_tap_center(ctx.sh, ctx.ps, ctx.waits.after_tap_advance)
+        ctx.tag_taps = tag_three_star_once(ctx.cfg, ctx.sh, ctx.ps, ctx.tag_taps)
+    return Tag3StarState.NEXT  # untagged: keep appraise open for next mon
+
+def _do_next(ctx: _Ctx) -> Tag3StarState:
+    if end_of_list_after_swipe(ctx.cfg, "next_pokemon", ctx.sh, ctx.ps):
+        return Tag3StarState.DONE
+    # If we tagged, we’re back on detail view; need to reopen appraise.
+    # Heuristic: look for the hamburger and the appraise badge together, both
+    # matched on the same frame; the badge wins and means we’re still in
+    # appraise and can jump to TAP_TO_STATS without reopening it.
+    am = ctx.am
+    hits, _ = wait_and_find_batch(ctx.cfg, [am.three_bars, am.three_stars_badge], ctx.ps)
+    hit = hits.get(am.three_bars)
+    if hit is not None and hits.get(am.three_stars_badge) is None:
+        x, y = center_of(hit)
+        tap_points(ctx.sh, [(x, y, int(ctx.waits.after_three_bars * 1000))])
+        tap_locator(ctx.cfg, am.appraise_btn, ctx.sh, ctx.ps, ctx.waits.after_open_appraise)
+    return Tag3StarState.TAP_TO_STATS
+
+# state -> handler returning the next state; DONE has none and ends the pass
+_HANDLERS: Dict[Tag3StarState, Callable[[_Ctx], Tag3StarState]] = {
+    Tag3StarState.OPEN_FIRST: _do_open_first,
+    Tag3StarState.OPEN_MENU: _do_open_menu,
+    Tag3StarState.TAP_TO_STATS: _do_tap_to_stats,
+    Tag3StarState.EVAL_STARS: _do_eval_stars,
+    Tag3StarState.NEXT: _do_next,
+}
 
 def tag_three_star_pass(cfg: UiPack, sh: ShellSession, ps: PngStream, *, adb: str = "adb", serial: str | None = None):
-    if not playing_pogo(PKG, ACTIVITY, cfg, adb=adb, serial=serial):
+    launch_by = time.time() + cfg.waits.after_launch
+    if not playing_pogo(PKG, ACTIVITY, cfg, adb=adb, serial=serial, sh=sh):
         return
+    # The activity is resumed long before the game has loaded: spend what is left
+    # of after_launch waiting for the top bar (instant when it is already up)
+    wait_and_find_gray(cfg, cfg.top_bar.main_menu, ps, timeout=launch_by - time.time())
 
     # Navigate to Pokémon list
     assert open_pokemon_list(cfg, sh, ps)
 
+    ctx = _Ctx(cfg, sh, ps, cfg.appraise_menu, cfg.waits)
+    handlers = _HANDLERS
     state = Tag3StarState.OPEN_FIRST
-    running = True
-
-    while running:
-        if state == Tag3StarState.OPEN_FIRST:
-            select_first_pokemon(cfg, sh, ps)
-            state = Tag3StarState.OPEN_MENU
-
-        elif state == Tag3StarState.OPEN_MENU:
-            open_appraise_flow(cfg, sh, ps)
-            state = Tag3StarState.TAP_TO_STATS
-
-        elif state == Tag3StarState.TAP_TO_STATS:
-            single_tap_center(sh, ps, cfg.waits.after_tap_advance)  # enter stats in appraise
-            state = Tag3StarState.EVAL_STARS
-
-        elif state == Tag3StarState.EVAL_STARS:
-            if exists(cfg, cfg.appraise_menu.three_stars_badge, ps, timeout=1.0):
-                # exit appraise (one tap) then tag
-                single_tap_center(sh, ps, cfg.waits.after_tap_advance)
-                tag_three_star_once(cfg, sh, ps)
-                state = Tag3StarState.NEXT
-            else:
-                state = Tag3StarState.NEXT  # keep appraise open for next mon
-
-        elif state == Tag3StarState.NEXT:
-            if end_of_list_after_swipe(cfg, "next_pokemon", sh, ps):
-                state = Tag3StarState.DONE
-            else:
-                # If we tagged, we’re back on detail view; need to reopen appraise.
-                # Heuristic: try hamburger; if not found quickly, we’re still in appraise and can jump to TAP_TO_STATS.
-                if tap_locator(cfg, cfg.appraise_menu.three_bars, sh, ps, cfg.waits.after_three_bars):
-                    tap_locator(cfg, cfg.appraise_menu.appraise_btn, sh, ps, cfg.waits.after_open_appraise)
-                    state = Tag3StarState.TAP_TO_STATS
-                else:
-                    state = Tag3StarState.TAP_TO_STATS
-
-        elif state == Tag3StarState.DONE:
-            running = False
+    while state is not Tag3StarState.DONE:
+        state = handlers[state](ctx)
@@ -1,79 +1,232 @@
 # pogo_ui.py
 import time
-from typing import Optional
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence, Set, Tuple
 
 import numpy as np
 
-from io_fast import ShellSession, PngStream, decode_png
+from io_fast import ShellSession, PngStream, digest64, decode_png
 from pogo_adb import start_app, is_foreground
-from pogo_config import UiPack, Swipe
-from pogo_cv import find_locator, center_of, signatures_from_frame
+from pogo_config import UiPack, CompiledUi, center_tap_for
+from pogo_cv import (find_locator, find_locators_batch, center_of, build_screen_pyramid, screen_to_gray,
+                     rects_for, dhash, IdCache)
 
 def _next_frame(ps: PngStream) -> np.ndarray:
     while True:
-        png = ps.next_png()
-        if png is None:
-            continue
-        img = decode_png(png)
+        img = ps.next_frame()
         if img is not None:
             return img
 
-def wait_and_find(cfg: UiPack, locator, ps: PngStream, timeout: float = 3.0, poll: float = 0.12):
+def _next_changed_gray(ps: PngStream, last, timeout: float):
+    # (frame, gray, digest). Locators only need luma, so the stream decodes
+    # straight to one gray plane and that doubles as the frame; every locator
+    # probed on it matches against (and is cached by) that plane.
+    gray, last = ps.next_changed(last, timeout, gray=True)
+    return gray, gray, last
+
+# (asset_dir, locator, frame digest, epoch) -> hit or None. The UI is mostly static
+# between taps, so re-polling an unchanged screen skips matchTemplate entirely.
+# _EPOCH is bumped on every tap/swipe so nothing survives an input.
+_FIND_CACHE: "OrderedDict[tuple, object]" = OrderedDict()
+_FIND_CACHE_SIZE = 32
+_EPOCH = 0
+
+# Streams a tap helper started a prefetch on; any later input makes it stale
+_PREFETCHING: Set[PngStream] = set()
+
+def _bump_epoch():
+    # Called right after every input goes out
+    global _EPOCH
+    _EPOCH += 1
+    for ps in _PREFETCHING:
+        ps.drop_prefetch()
+    _PREFETCHING.clear()
+
+def _prefetch(ps: PngStream):
+    # After _bump_epoch: the read overlaps the settle wait that follows the input
+    if ps.prefetch_next():
+        _PREFETCHING.add(ps)
+
+def _cache_put(key, hit):
+    _FIND_CACHE[key] = hit
+    if len(_FIND_CACHE) > _FIND_CACHE_SIZE:
+        _FIND_CACHE.popitem(last=False)
+
+def _cached_find(cfg: UiPack, locator, frame: np.ndarray, gray: Optional[np.ndarray] = None):
+    if gray is None:
+        gray = screen_to_gray(frame)
+    key = (cfg.asset_dir, locator, digest64(np.ascontiguousarray(gray)), _EPOCH)
+    if key in _FIND_CACHE:
+        _FIND_CACHE.move_to_end(key)
+        return _FIND_CACHE[key]
+    hit = find_locator(cfg, locator, frame, build_screen_pyramid(gray))
+    _cache_put(key, hit)
+    return hit
+
+def _cached_batch(cfg: UiPack, locators: Sequence, gray: np.ndarray) -> Dict:
+    # Like _cached_find for several locators on one frame: the misses are matched
+    # together by find_locators_batch and every result lands in _FIND_CACHE.
+    d = digest64(np.ascontiguousarray(gray))
+    out, missing = {}, []
+    for loc in locators:
+        key = (cfg.asset_dir, loc, d, _EPOCH)
+        if key in _FIND_CACHE:
+            _FIND_CACHE.move_to_end(key)
+            out[loc] = _FIND_CACHE[key]
+        else:
+            missing.append(loc)
+    if missing:
+        for loc, hit in find_locators_batch(cfg, missing, gray).items():
+            _cache_put((cfg.asset_dir, loc, d, _EPOCH), hit)
+            out[loc] = hit
+    return out
+
+def wait_and_find(cfg: UiPack, locator, ps: PngStream, timeout: float = 3.0):
+    """
+    (hit, BGR frame) for the first changed frame locator is found on, (None, None)
+    on timeout. The frame is the caller's own copy; locators are still matched on
+    its gray plane. Use wait_and_find_gray when only the hit (or luma) is needed.
+    """
     t0 = time.time()
-    hit = None
-    while time.time() - t0 < timeout:
-        frame = _next_frame(ps)
-        hit = find_locator(cfg, locator, frame)
+    last = None
+    while True:
+        remaining = timeout - (time.time() - t0)
+        if remaining <= 0:
+            return None, None
+        frame, last = ps.next_changed(last, remaining)
+        if frame is None:
+            return None, None
+        hit = _cached_find(cfg, locator, frame, screen_to_gray(frame))
         if hit:
-            return hit, frame
-        time.sleep(poll)
-    return None, None
+            # The source decodes into a reused buffer; the next frame would overwrite it
+            return hit, frame.copy()
 
-def tap_locator(cfg: UiPack, locator, sh: ShellSession, ps: PngStream, wait_after: float = 0.0) -> bool:
-    hit, frame = wait_and_find(cfg, locator, ps, timeout=3.0)
+def wait_and_find_gray(cfg: UiPack, locator, ps: PngStream, timeout: float = 3.0):
+    """
+    wait_and_find on frames decoded straight to gray: returns (hit, gray plane).
+    The plane is the stream's reused buffer, valid only until its next frame.
+    """
+    # No fixed poll interval: frames are taken as soon as they change (ps.next_changed).
+    t0 = time.time()
+    last = None
+    while True:
+        remaining = timeout - (time.time() - t0)
+        if remaining <= 0:
+            return None, None
+        frame, gray, last = _next_changed_gray(ps, last, remaining)
+        if frame is None:
+            return None, None
+        hit = _cached_find(cfg, locator, frame, gray)
+        if hit:
+            return hit, gray
+
+def wait_and_find_batch(cfg: UiPack, locators: Sequence, ps: PngStream, timeout: float = 3.0):
+    """
+    Wait until any of locators shows up; returns ({locator: hit or None}, gray frame)
+    with every locator matched on that frame, so callers can rank the hits.
+    ({}, None) on timeout.
+    """
+    t0 = time.time()
+    last = None
+    while True:
+        remaining = timeout - (time.time() - t0)
+        if remaining <= 0:
+            return {}, None
+        frame, gray, last = _next_changed_gray(ps, last, remaining)
+        if frame is None:
+            return {}, None
+        hits = _cached_batch(cfg, locators, gray)
+        if any(h is not None for h in hits.values()):
+            return hits, frame
+
+def locate_and_tap(cfg: UiPack, locator, sh: ShellSession, ps: PngStream,
+                   wait_after: float = 0.0) -> Optional[Tuple[int, int]]:
+    """tap_locator, but returns the tapped point (None if not found)."""
+    hit, _ = wait_and_find_gray(cfg, locator, ps, timeout=3.0)
     if not hit:
-        return False
+        return None
     x, y = center_of(hit)
-    sh.tap(x, y)
+    sh.tap(x, y)  # submitted, not awaited
+    _bump_epoch()
+    _prefetch(ps)
     if wait_after:
         time.sleep(wait_after)
-    return True
+    return x, y
+
+def tap_then_find(cfg: UiPack, locator, sh: ShellSession, x: int, y: int, settle: float = 0.2):
+    """
+    Tap (x, y) and match locator on a screencap taken settle seconds later in the
+    same shell round trip (ShellSession.tap_then_capture); returns the hit or None.
+    """
+    png = sh.tap_then_capture(x, y, settle)
+    _bump_epoch()
+    if not png.startswith(b"\x89PNG\r\n\x1a\n"):
+        return None
+    gray = decode_png(png, gray=True)
+    return _cached_find(cfg, locator, gray, gray)
+
+def tap_locator(cfg: UiPack, locator, sh: ShellSession, ps: PngStream, wait_after: float = 0.0) -> bool:
+    return locate_and_tap(cfg, locator, sh, ps, wait_after) is not None
+
+def tap_points(sh: ShellSession, taps: Sequence[Tuple[int, int, int]]):
+    """Replay (x, y, delay_ms) taps in one shell write and wait for them to play out."""
+    sh.wait_for(sh.tap_batch(taps), timeout=10.0 + sum(t[2] for t in taps) / 1000)
+    _bump_epoch()
 
 def exists(cfg: UiPack, locator, ps: PngStream, timeout: float = 1.2) -> bool:
-    hit, _ = wait_and_find(cfg, locator, ps, timeout=timeout, poll=0.12)
+    hit, _ = wait_and_find_gray(cfg, locator, ps, timeout=timeout)
     return hit is not None
 
+# (cfg, W, H) -> compiled
+_COMPILED_CACHE = IdCache()
+
+def _compiled(cfg: UiPack, ps: PngStream) -> CompiledUi:
+    # Size from the stream's frame headers: no frame has to be fetched or decoded
+    W, H = ps.width, ps.height
+    return _COMPILED_CACHE.get(cfg, W, H, make=lambda: cfg.compile_for(W, H))
+
 def single_tap_center(sh: ShellSession, ps: PngStream, wait_after: float = 0.0):
-    frame = _next_frame(ps)
-    H, W = frame.shape[:2]
-    sh.tap(W // 2, int(H * 0.65))
+    # Size from the frame headers as in _compiled; the point needs no cfg
+    sh.tap(*center_tap_for(ps.width, ps.height))
+    _bump_epoch()
+    _prefetch(ps)
     if wait_after:
         time.sleep(wait_after)
 
-def _abs_points_from_swipe(frame: np.ndarray, swipe: Swipe):
-    H, W = frame.shape[:2]
-    sx = int(W * swipe.start[0]); sy = int(H * swipe.start[1])
-    ex = int(W * swipe.end[0]);   ey = int(H * swipe.end[1])
-    return sx, sy, ex, ey
-
 def swipe_by_name(cfg: UiPack, key: str, sh: ShellSession, ps: PngStream, wait_after: float = 0.0):
-    frame = _next_frame(ps)
-    if key not in cfg.swipes:
+    swipe = _compiled(cfg, ps).swipes.get(key)
+    if swipe is None:
         raise KeyError(f"Unknown swipe '{key}'")
-    sx, sy, ex, ey = _abs_points_from_swipe(frame, cfg.swipes[key])
-    sh.swipe(sx, sy, ex, ey, cfg.swipes[key].duration_ms)
+    sh.swipe(*swipe)
+    _bump_epoch()
     if wait_after:
         time.sleep(wait_after)
 
+def _list_fingerprint(cfg: UiPack, frame: np.ndarray) -> bytes:
+    R = rects_for(cfg, frame)
+    return dhash(R.crop(frame, "sig_rects.cp")) + dhash(R.crop(frame, "sig_rects.weight"))
+
 def end_of_list_after_swipe(cfg: UiPack, key: str, sh: ShellSession, ps: PngStream) -> bool:
-    before = signatures_from_frame(cfg, _next_frame(ps))
+    before = _list_fingerprint(cfg, _next_frame(ps))
     swipe_by_name(cfg, key, sh, ps, wait_after=cfg.waits.after_swipe)
-    after = signatures_from_frame(cfg, _next_frame(ps))
+    after = _list_fingerprint(cfg, _next_frame(ps))
     return before == after
 
-def playing_pogo(pkg: str, activity: str, cfg: UiPack, *, adb: str = "adb", serial: str | None = None) -> bool:
-    if is_foreground(pkg, adb=adb, serial=serial):
+def playing_pogo(pkg: str, activity: str, cfg: UiPack, *, adb: str = "adb", serial: str | None = None,
+                 sh: ShellSession | None = None) -> bool:
+    if is_foreground(pkg, adb=adb, serial=serial, sh=sh, max_age=cfg.waits.after_menu_open):
         return True
-    start_app(pkg, activity, adb=adb, serial=serial)
-    time.sleep(cfg.waits.after_launch)
-    return is_foreground(pkg, adb=adb, serial=serial)
+    start_app(pkg, activity, adb=adb, serial=serial, sh=sh)
+    # Poll with exponential backoff instead of sleeping out after_launch: return
+    # as soon as the activity is on top, give up once after_launch has passed.
+    # On top is not loaded; callers wait out the rest of after_launch for the UI.
+    deadline = time.time() + cfg.waits.after_launch
+    delay = 0.05
+    while True:
+        if is_foreground(pkg, adb=adb, serial=serial, sh=sh):
+            return True
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        time.sleep(min(delay, remaining))
+        delay *= 2
@@ -0,0 +1,35 @@
+# tests/test_pogo_cv.py
+import cv2
+import numpy as np
+import pytest
+
+from pogo_cv import build_screen_pyramid, match_template
+
+
+def _hamburger(bar: int) -> np.ndarray:
+    # 64x48 icon: three dark horizontal bars of height bar px on a light tile
+    tpl = np.full((48, 64), 230, dtype=np.uint8)
+    for y in (12, 23, 34):
+        tpl[y:y + bar, 8:56] = 40
+    return tpl
+
+
+def _frame() -> np.ndarray:
+    rng = np.random.default_rng(7)
+    img = cv2.GaussianBlur(rng.integers(0, 255, (480, 320), dtype=np.uint8), (0, 0), 5)
+    return cv2.normalize(img, None, 0, 255, cv2.NORM_MINMAX)
+
+
+@pytest.mark.parametrize("bar", [2, 3])
+@pytest.mark.parametrize("dy", range(4))
+@pytest.mark.parametrize("dx", range(4))
+def test_thin_bar_icon_found_at_every_offset(bar, dx, dy):
+    # The 1/4-resolution pre-screen must not reject an exact thin-stroke match,
+    # whatever its alignment to the coarse pixel grid.
+    tpl = _hamburger(bar)
+    frame = _frame()
+    x, y = 200 + dx, 320 + dy
+    frame[y:y + 48, x:x + 64] = tpl
+    hit = match_template(build_screen_pyramid(frame), tpl, 0.86)
+    assert hit is not None
+    assert (hit[0], hit[1]) == (x, y)